@@ -1,8 +1,14 @@
+import asyncio
+import contextlib
+import json
 import os
-from typing import List, Optional
+from typing import Any, AsyncIterator, List, Optional, Tuple
 
+import aiofiles
+import aiofiles.os
 from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request
-from fastapi.responses import JSONResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.exception_handlers import http_exception_handler
 
 from utils.logging_config import get_logger
@@ -10,6 +16,9 @@ from rag_service import RAGService, RAGError
 
 logger = get_logger("app")
 
+# uploads are copied to disk in pieces of this size
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
 app = FastAPI(title="RAG Chatbot API")
 service = None
 
@@ -23,26 +32,36 @@ def startup_event():
         logger.exception("Failed to initialize RAGService on startup")
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    if service is not None:
+        await service.aclose()
+
+
 @app.post("/chat")
 async def chat(
-    question: str = Form(...), files: Optional[List[UploadFile]] = File(None), k: int = Form(5)
+    question: str = Form(...), files: Optional[List[UploadFile]] = File(None), k: int = Form(6)
 ):
     if not question or not question.strip():
         raise HTTPException(status_code=400, detail="Question is required")
 
     # ingest uploaded files, if any
     if files:
-        file_bytes = []
-        for f in files:
-            try:
-                content = await f.read()
-            except Exception:
-                logger.exception("Failed to read uploaded file")
-                raise HTTPException(status_code=400, detail=f"Failed to read file {f.filename}")
-            file_bytes.append((f.filename, content))
-
+        spooled: List[Tuple[str, str]] = []
         try:
-            service.ingest_bytes_list(file_bytes)
+            # read all uploads concurrently; collect every result first so
+            # temp files from the successful ones are still cleaned up
+            results = await asyncio.gather(*(_spool_upload(f) for f in files), return_exceptions=True)
+            spooled = [(f.filename, r) for f, r in zip(files, results) if not isinstance(r, BaseException)]
+            for f, r in zip(files, results):
+                if isinstance(r, BaseException):
+                    logger.error("Failed to read uploaded file", exc_info=r)
+                    raise HTTPException(status_code=400, detail=f"Failed to read file {f.filename}")
+
+            # parsing and embedding are blocking; keep them off the event loop
+            await run_in_threadpool(service.ingest_files, spooled)
+        except HTTPException:
+            raise
         except ValueError as e:
             logger.warning("Ingestion called with no files or empty files")
             raise HTTPException(status_code=400, detail=str(e))
@@ -52,9 +71,18 @@ async def chat(
         except Exception:
             logger.exception("Unexpected ingestion error")
             raise HTTPException(status_code=500, detail="Ingestion failed")
-
+        finally:
+            for _, path in spooled:
+                try:
+                    await aiofiles.os.remove(path)
+                except OSError:
+                    logger.warning("Failed to remove temporary upload %s", path)
+
+    # pull the first event eagerly so retrieval / LLM start-up errors still
+    # map to a proper status code before the stream is opened
+    events = service.query_stream(question, k)
     try:
-        answer, sources = service.query(question, k)
+        first_event = await anext(events)
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except RAGError as e:
@@ -64,7 +92,44 @@ async def chat(
         logger.exception("Unhandled error during query")
         raise HTTPException(status_code=500, detail="Internal server error")
 
-    return JSONResponse({"answer": answer, "sources": sources})
+    return StreamingResponse(
+        _sse_stream(first_event, events),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def _spool_upload(f: UploadFile) -> str:
+    path = None
+    try:
+        async with aiofiles.tempfile.NamedTemporaryFile("wb", suffix=".pdf", delete=False) as tmp:
+            path = tmp.name
+            while chunk := await f.read(UPLOAD_CHUNK_SIZE):
+                await tmp.write(chunk)
+        return path
+    except Exception as e:
+        if path is not None:
+            with contextlib.suppress(OSError):
+                await aiofiles.os.remove(path)
+        e.add_note(f"while reading upload {f.filename!r}")
+        raise
+
+
+def _sse(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def _sse_stream(first_event: Tuple[str, Any], events: AsyncIterator[Tuple[str, Any]]):
+    try:
+        yield _sse(*first_event)
+        async for event, data in events:
+            yield _sse(event, data)
+    except RAGError as e:
+        logger.exception("RAGService error while streaming answer")
+        yield _sse("error", {"detail": str(e)})
+    except Exception:
+        logger.exception("Unhandled error while streaming answer")
+        yield _sse("error", {"detail": "Internal server error"})
 
 
 @app.get("/health")
@@ -74,7 +139,7 @@ def health():
 
 @app.exception_handler(HTTPException)
 async def custom_http_exception_handler(request: Request, exc: HTTPException):
-    logger.warning(f"HTTP error: {exc.detail}")
+    logger.warning("HTTP error: %s", exc.detail)
     return await http_exception_handler(request, exc)
 
 
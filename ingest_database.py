@@ -1,5 +1,5 @@
 from langchain_community.document_loaders import PyPDFDirectoryLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+from utils.text_splitter import CachedTokenTextSplitter
 from langchain_openai.embeddings import OpenAIEmbeddings
 from langchain_chroma import Chroma
 from uuid import uuid4
@@ -28,10 +28,10 @@ loader = PyPDFDirectoryLoader(DATA_PATH)
 raw_documents = loader.load()
 
 # splitting the document
-text_splitter = RecursiveCharacterTextSplitter(
-    chunk_size=300,
-    chunk_overlap=100,
-    length_function=len,
+text_splitter = CachedTokenTextSplitter(
+    encoding_name="cl100k_base",
+    chunk_size=200,
+    chunk_overlap=20,
     is_separator_regex=False,
 )
 
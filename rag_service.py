@@ -1,43 +1,133 @@
-import io
-import time
-import uuid
-from typing import List, Tuple, Optional
-
-from dotenv import load_dotenv
-load_dotenv()
+import asyncio
+import hashlib
+import itertools
+import logging
+import math
+import multiprocessing
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, AsyncIterator, List, Tuple, Optional
+
+from langchain_core.documents import Document
+from tenacity import before_sleep_log, retry, stop_after_attempt, wait_random_exponential
 
 from utils.logging_config import get_logger
+from utils.pdf_extract import extract_page_range, open_pdf, page_text
 logger = get_logger("rag_service")
 
-from langchain.schema import Document
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
-from langchain_chroma import Chroma
+# the OpenAI / Chroma / PyMuPDF / tokenizer stacks are imported where they are
+# first needed, so importing this module doesn't pull them in
+
+EMBEDDING_MODEL = "text-embedding-3-large"
+# texts per embeddings request / vector store insert during ingestion
+EMBED_BATCH_SIZE = 512
+# smaller PDFs are extracted in-process; pool startup would dominate
+PARALLEL_PDF_MIN_PAGES = 10
+# LLM attempts (with jittered exponential backoff) before the first token
+LLM_MAX_ATTEMPTS = 3
+# retrieval: client-supplied k is clamped to MAX_K; MMR picks k out of at most
+# MMR_MAX_FETCH_K nearest chunks, trading relevance against diversity
+MAX_K = 10
+MMR_MAX_FETCH_K = 40
+MMR_LAMBDA = 0.5
+# max answers kept in the in-memory query cache
+QUERY_CACHE_SIZE = 1024
+
+# static parts of the RAG prompt; only the question and knowledge vary per call
+RAG_PROMPT_PREFIX = """
+    You are an assistant which answers questions based only on the knowledge provided in the "The knowledge" section below.
+    Do not use external or internal world knowledge beyond the provided knowledge.
+    Keep the answer concise (max ~150 words). At the end, do NOT repeat the full source text — instead answer, then the system will provide exact source snippets separately.
+
+    Question: """
+RAG_PROMPT_KNOWLEDGE_HEADER = """
 
-import pypdf
+    The knowledge:
+    """
 
 
 class RAGError(Exception):
     pass
 
 
+def _chunk_id(chunk: Document) -> str:
+    key = f"{chunk.metadata.get('source')}:{chunk.metadata.get('page')}:{chunk.page_content}"
+    return hashlib.blake2b(key.encode("utf-8"), digest_size=16).hexdigest()
+
+
 class RAGService:
-    def __init__(self, chroma_path: str = "chroma_db", collection_name: str = "example_collection"):
+    def __init__(
+        self,
+        chroma_path: str = "chroma_db",
+        collection_name: str = "example_collection",
+        num_workers: int = min(os.cpu_count() or 1, 4),
+        embedding_cache_path: str = "embedding_cache",
+    ):
+        from dotenv import load_dotenv
+        load_dotenv()
+
+        import httpx
+        from utils.quantized_index import QuantizedVectorIndex
+        from utils.text_splitter import CachedTokenTextSplitter
+
         self.logger = logger
         self.chroma_path = chroma_path
         self.collection_name = collection_name
+        self.num_workers = max(1, num_workers)
+        # page extraction pool, created on first large PDF
+        self._pdf_pool: Optional[ProcessPoolExecutor] = None
+        self._pdf_pool_lock = threading.Lock()
+        # LRU of (answer, sources) keyed by normalized question + k
+        self._query_cache: "OrderedDict[str, Tuple[str, List[dict]]]" = OrderedDict()
+        self._query_cache_lock = threading.Lock()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        # keeps Chroma writes and the quantized index in step
+        self._index_lock = threading.Lock()
+
+        # one keep-alive connection pool per client, shared by the embeddings
+        # model and the LLM so TLS handshakes happen once per worker
+        http_limits = httpx.Limits(max_keepalive_connections=50, max_connections=100)
+        self._http_client = httpx.Client(limits=http_limits)
+        self._http_async_client = httpx.AsyncClient(limits=http_limits)
 
         # initialize models and vector store with error handling
         try:
             self.logger.info("Initializing embeddings model")
-            self.embeddings_model = OpenAIEmbeddings(model="text-embedding-3-large")
+            from langchain.embeddings import CacheBackedEmbeddings
+            from langchain.storage import LocalFileStore
+            from langchain_openai import OpenAIEmbeddings
+            openai_embeddings = OpenAIEmbeddings(
+                model=EMBEDDING_MODEL,
+                chunk_size=EMBED_BATCH_SIZE,
+                max_retries=5,
+                http_client=self._http_client,
+                http_async_client=self._http_async_client,
+            )
+            # document vectors are cached on disk by content hash, namespaced by
+            # model so switching models never serves stale vectors
+            self.embeddings_model = CacheBackedEmbeddings.from_bytes_store(
+                openai_embeddings,
+                LocalFileStore(embedding_cache_path),
+                namespace=EMBEDDING_MODEL,
+            )
         except Exception as e:
             self.logger.exception("Failed to initialize embeddings model")
             raise RAGError("Embeddings initialization failed") from e
 
         try:
             self.logger.info("Initializing LLM")
-            self.llm = ChatOpenAI(temperature=0.5, model='gpt-4o-mini')
+            from langchain_openai import ChatOpenAI
+            self.llm = ChatOpenAI(
+                temperature=0.5,
+                model='gpt-4o-mini',
+                http_client=self._http_client,
+                http_async_client=self._http_async_client,
+            )
         except Exception:
             self.logger.exception("Failed to initialize LLM")
             # don't expose internals
@@ -45,6 +135,7 @@ class RAGService:
 
         try:
             self.logger.info("Connecting to Chroma vector store")
+            from langchain_chroma import Chroma
             self.vector_store = Chroma(
                 collection_name=self.collection_name,
                 embedding_function=self.embeddings_model,
@@ -54,148 +145,401 @@ class RAGService:
             self.logger.exception("Failed to connect to ChromaDB")
             raise RAGError("ChromaDB unavailable")
 
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=300,
-            chunk_overlap=100,
-            length_function=len,
+        # retrieval runs against a quantized copy of the stored embeddings
+        self.quantized_index = QuantizedVectorIndex(
+            os.path.join(self.chroma_path, f"{self.collection_name}.quantized.npz")
+        )
+        try:
+            self._load_quantized_index()
+        except Exception:
+            self.logger.exception("Failed to load quantized vector index")
+            raise RAGError("Vector index unavailable")
+
+        # chunk by embedding-model tokens (cl100k_base is the
+        # text-embedding-3-large encoding) rather than characters
+        self.text_splitter = CachedTokenTextSplitter(
+            encoding_name="cl100k_base",
+            chunk_size=200,
+            chunk_overlap=20,
             is_separator_regex=False,
         )
 
         self.logger.info("RAGService initialized")
 
-    def _pdf_bytes_to_documents(self, filename: str, file_bytes: bytes) -> List[Document]:
-        reader = pypdf.PdfReader(io.BytesIO(file_bytes))
-        docs: List[Document] = []
-        for i, page in enumerate(reader.pages):
+    def _get_pdf_pool(self) -> ProcessPoolExecutor:
+        # ingestions run concurrently in the threadpool; start one pool only
+        with self._pdf_pool_lock:
+            if self._pdf_pool is None:
+                self.logger.info("Starting PDF extraction pool with %s workers", self.num_workers)
+                # spawn rather than fork: the server process already runs threads
+                self._pdf_pool = ProcessPoolExecutor(
+                    max_workers=self.num_workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._pdf_pool
+
+    def _discard_pdf_pool(self, pool: ProcessPoolExecutor):
+        with self._pdf_pool_lock:
+            # another thread may already have replaced it
+            if self._pdf_pool is pool:
+                self._pdf_pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def close(self):
+        if self._pdf_pool is not None:
+            self._discard_pdf_pool(self._pdf_pool)
+        self._http_client.close()
+
+    async def aclose(self):
+        self.close()
+        await self._http_async_client.aclose()
+
+    def _extract_in_pool(self, filename: str, ranges: List[Tuple[str, int, int]]) -> List[Tuple[int, str]]:
+        # a worker dying (OOM, MuPDF crash) breaks the whole pool; the pool may
+        # also have been broken by another file, so retry once on a fresh one.
+        # Never fall back to extracting in-process: the same crash would take
+        # the server down with it
+        for attempt in range(2):
+            pool = self._get_pdf_pool()
             try:
-                text = page.extract_text() or ""
-            except Exception:
-                text = ""
-            metadata = {"source": filename, "page": i + 1}
-            docs.append(Document(page_content=text, metadata=metadata))
-        return docs
+                return [r for chunk in pool.map(extract_page_range, ranges) for r in chunk]
+            except BrokenProcessPool:
+                self._discard_pdf_pool(pool)
+                if attempt:
+                    raise
+                self.logger.warning("PDF extraction pool broke on %s; retrying on a fresh pool", filename)
+
+    def _pdf_to_documents(self, filename: str, path: str) -> List[Document]:
+        with open_pdf(path) as pdf:
+            num_pages = pdf.page_count
+            if self.num_workers > 1 and num_pages > PARALLEL_PDF_MIN_PAGES:
+                step = math.ceil(num_pages / self.num_workers)
+                ranges = [(path, start, min(start + step, num_pages)) for start in range(0, num_pages, step)]
+                results = self._extract_in_pool(filename, ranges)
+            else:
+                results = [(i, page_text(page)) for i, page in enumerate(pdf)]
+
+        return [Document(page_content=text, metadata={"source": filename, "page": i + 1}) for i, text in results]
 
     def ingest_bytes_list(self, files: List[Tuple[str, bytes]]):
         if not files:
             self.logger.warning("ingest_bytes_list called with empty file list")
             raise ValueError("No files provided for ingestion")
 
-        all_chunks = []
+        # write each PDF to a real file once; extraction then works from disk
+        paths: List[Tuple[str, str]] = []
+        try:
+            for filename, b in files:
+                with tempfile.NamedTemporaryFile("wb", suffix=".pdf", delete=False) as tf:
+                    # tracked before writing so a failed write is still cleaned up
+                    paths.append((filename, tf.name))
+                    tf.write(b)
+            self.ingest_files(paths)
+        finally:
+            for _, path in paths:
+                try:
+                    os.remove(path)
+                except OSError:
+                    self.logger.warning("Failed to remove temporary file %s", path)
+
+    def ingest_files(self, files: List[Tuple[str, str]]):
+        """Ingest PDFs given as (display filename, path on disk) pairs."""
+        if not files:
+            self.logger.warning("ingest_files called with empty file list")
+            raise ValueError("No files provided for ingestion")
+
+        per_file_chunks: List[List[Document]] = []
         total_docs = 0
-        for filename, b in files:
-            self.logger.info(f"Ingesting file: {filename}")
+        for filename, path in files:
+            self.logger.info("Ingesting file: %s", filename)
             try:
-                documents = self._pdf_bytes_to_documents(filename, b)
+                documents = self._pdf_to_documents(filename, path)
             except Exception as e:
-                self.logger.exception(f"Failed to parse PDF: {filename}")
+                self.logger.exception("Failed to parse PDF: %s", filename)
                 continue
 
             total_docs += len(documents)
 
             if not any((d.page_content or "").strip() for d in documents):
-                self.logger.warning(f"No text extracted from {filename}")
+                self.logger.warning("No text extracted from %s", filename)
                 continue
 
             try:
                 chunks = self.text_splitter.split_documents(documents)
             except Exception:
-                self.logger.exception(f"Failed to split document: {filename}")
+                self.logger.exception("Failed to split document: %s", filename)
                 continue
 
             # attach filename metadata is already present on docs; chunks preserve metadata
-            all_chunks.extend(chunks)
-            self.logger.info(f"Created {len(chunks)} chunks for {filename}")
+            per_file_chunks.append(chunks)
+            self.logger.info("Created %s chunks for %s", len(chunks), filename)
 
+        all_chunks = list(itertools.chain.from_iterable(per_file_chunks))
         if not all_chunks:
             self.logger.warning("No chunks to add to vector store after processing files")
             return
 
-        uuids = [str(uuid.uuid4()) for _ in range(len(all_chunks))]
+        # content-derived ids: re-ingesting the same PDF maps onto the chunks
+        # already stored, and duplicates within this batch collapse to one
+        chunks_by_id = {}
+        for chunk in all_chunks:
+            chunks_by_id.setdefault(_chunk_id(chunk), chunk)
+        ids = list(chunks_by_id)
+
+        added = 0
         try:
-            self.vector_store.add_documents(documents=all_chunks, ids=uuids)
-            # some Chroma wrappers offer persist; guard call
-            try:
-                if hasattr(self.vector_store, "persist"):
-                    self.vector_store.persist()
-            except Exception:
-                self.logger.debug("Chroma persist() not available or failed; continuing")
+            # embed and insert in fixed-size batches so each slice is a single
+            # embeddings request instead of letting the wrapper decide
+            for start in range(0, len(ids), EMBED_BATCH_SIZE):
+                batch_ids = ids[start:start + EMBED_BATCH_SIZE]
+                existing = set(self.vector_store._collection.get(ids=batch_ids, include=[])["ids"])
+                batch_ids = [i for i in batch_ids if i not in existing]
+                if not batch_ids:
+                    continue
+                batch = [chunks_by_id[i] for i in batch_ids]
+                texts = [c.page_content for c in batch]
+                vectors = self.embeddings_model.embed_documents(texts)
+                with self._index_lock:
+                    # a concurrent ingestion may have stored some of these meanwhile
+                    existing = set(self.vector_store._collection.get(ids=batch_ids, include=[])["ids"])
+                    new = [j for j, i in enumerate(batch_ids) if i not in existing]
+                    if not new:
+                        continue
+                    batch_ids = [batch_ids[j] for j in new]
+                    vectors = [vectors[j] for j in new]
+                    self.vector_store._collection.add(
+                        ids=batch_ids,
+                        embeddings=vectors,
+                        documents=[texts[j] for j in new],
+                        metadatas=[batch[j].metadata for j in new],
+                    )
+                    self.quantized_index.add(batch_ids, vectors)
+                added += len(batch_ids)
         except Exception:
             self.logger.exception("Failed to upsert documents into ChromaDB")
             raise RAGError("Failed to write to vector store")
+        finally:
+            if added:
+                self._save_quantized_index()
 
-        self.logger.info(f"Upserted {len(all_chunks)} chunks into ChromaDB from {total_docs} pages")
+        if not added:
+            self.logger.info("All %s chunks already stored; nothing to embed", len(ids))
+            return
 
-    def _build_knowledge(self, docs: List[Document]) -> str:
-        knowledge = ""
-        for doc in docs:
-            knowledge += (doc.page_content or "") + "\n\n"
-        return knowledge
+        # cached answers may be stale once new knowledge is available
+        self.clear_query_cache()
+        self.logger.info(
+            "Upserted %s new chunks into ChromaDB from %s pages (%s duplicates skipped)",
+            added, total_docs, len(all_chunks) - added,
+        )
 
-    def query(self, question: str, k: int = 5) -> Tuple[str, List[dict]]:
-        if not question or not question.strip():
-            raise ValueError("Empty question provided")
+    def _load_quantized_index(self):
+        total = self.vector_store._collection.count()
+        try:
+            loaded = self.quantized_index.load()
+        except Exception:
+            # the file is only a derived copy of what Chroma stores
+            self.logger.exception("Quantized index file unreadable; rebuilding")
+            loaded = False
+        if not loaded:
+            self._rebuild_quantized_index()
+            return
 
+        # out of date (e.g. ingest_database.py wrote to the collection while
+        # the server was down): only fetch the vectors that changed
+        if len(self.quantized_index) != total and self._sync_quantized_index_locked():
+            self._save_quantized_index()
+        self.logger.info("Loaded quantized index with %s vectors", len(self.quantized_index))
+
+    def _rebuild_quantized_index(self):
+        from utils.quantized_index import QuantizedVectorIndex
+
+        collection = self.vector_store._collection
+        total = collection.count()
+        self.logger.info("Building quantized index from %s stored vectors", total)
+        # built aside and swapped in once complete
+        index = QuantizedVectorIndex(self.quantized_index.path, self.quantized_index.rescore_factor)
+        for offset in range(0, total, EMBED_BATCH_SIZE):
+            stored = collection.get(include=["embeddings"], limit=EMBED_BATCH_SIZE, offset=offset)
+            index.add(stored["ids"], stored["embeddings"])
+        self.quantized_index = index
+        self._save_quantized_index()
+
+    def _sync_quantized_index(self):
+        # other processes sharing chroma_path (e.g. ingest_database.py or
+        # another uvicorn worker) write to the collection directly; a count
+        # mismatch means the index is stale
+        collection = self.vector_store._collection
+        if collection.count() == len(self.quantized_index):
+            return
+        with self._index_lock:
+            if collection.count() == len(self.quantized_index):
+                return
+            changed = self._sync_quantized_index_locked()
+        if changed:
+            # the .npz is rewritten by the next ingestion or reconciled on
+            # the next start; a query shouldn't pay for a full save
+            self.clear_query_cache()
+
+    def _sync_quantized_index_locked(self) -> bool:
+        """Bring the index in line with the collection's ids, fetching
+        embeddings only for ids the index doesn't have yet."""
+        collection = self.vector_store._collection
+        stored_ids = collection.get(include=[])["ids"]
+        indexed = set(self.quantized_index.ids())
+        missing = [i for i in stored_ids if i not in indexed]
+        removed = indexed.difference(stored_ids)
+        if removed:
+            self.quantized_index.remove(removed)
+        for start in range(0, len(missing), EMBED_BATCH_SIZE):
+            stored = collection.get(ids=missing[start:start + EMBED_BATCH_SIZE], include=["embeddings"])
+            self.quantized_index.add(stored["ids"], stored["embeddings"])
+        if missing or removed:
+            self.logger.info(
+                "Synced quantized index with Chroma: %s added, %s removed", len(missing), len(removed)
+            )
+        return bool(missing or removed)
+
+    def _save_quantized_index(self):
         try:
-            retriever = self.vector_store.as_retriever(search_kwargs={"k": k})
+            self.quantized_index.save()
         except Exception:
-            self.logger.exception("Failed to create retriever")
-            raise RAGError("Retrieval layer unavailable")
+            # not fatal: a stale file is detected and rebuilt on next start
+            self.logger.exception("Failed to save quantized vector index")
+
+    def _search_by_vector(self, query_embedding: List[float], k: int) -> List[Document]:
+        import numpy as np
+        from langchain_core.vectorstores.utils import maximal_marginal_relevance
+
+        self._sync_quantized_index()
+
+        # MMR over a small candidate pool: keeps the scan bounded and avoids
+        # handing the LLM several near-identical chunks
+        candidate_ids, candidate_vectors = self.quantized_index.search_with_vectors(
+            query_embedding, min(k * 4, MMR_MAX_FETCH_K)
+        )
+        if not candidate_ids:
+            return []
+        picked = maximal_marginal_relevance(
+            np.asarray(query_embedding, dtype=np.float32), candidate_vectors, lambda_mult=MMR_LAMBDA, k=k
+        )
+        ids = [candidate_ids[i] for i in picked]
+        stored = self.vector_store._collection.get(ids=ids, include=["documents", "metadatas"])
+        by_id = {
+            i: Document(page_content=text or "", metadata=metadata or {})
+            for i, text, metadata in zip(stored["ids"], stored["documents"], stored["metadatas"])
+        }
+        # Chroma returns rows in storage order; keep the ranking
+        return [by_id[i] for i in ids if i in by_id]
+
+    def clear_query_cache(self):
+        with self._query_cache_lock:
+            self._query_cache.clear()
+
+    def _query_cache_key(self, question: str, k: int) -> str:
+        normalized = question.strip().lower()
+        return hashlib.sha256(f"{k}:{normalized}".encode("utf-8")).hexdigest()
+
+    def _query_cache_get(self, key: str) -> Optional[Tuple[str, List[dict]]]:
+        with self._query_cache_lock:
+            entry = self._query_cache.get(key)
+            if entry is None:
+                self.cache_misses += 1
+                return None
+            self._query_cache.move_to_end(key)
+            self.cache_hits += 1
+            return entry
+
+    def _query_cache_put(self, key: str, answer: str, sources: List[dict]):
+        with self._query_cache_lock:
+            self._query_cache[key] = (answer, sources)
+            self._query_cache.move_to_end(key)
+            while len(self._query_cache) > QUERY_CACHE_SIZE:
+                self._query_cache.popitem(last=False)
+
+    def _build_knowledge(self, docs: List[Document]) -> str:
+        return "\n\n".join(doc.page_content or "" for doc in docs)
+
+    @retry(
+        stop=stop_after_attempt(LLM_MAX_ATTEMPTS),
+        wait=wait_random_exponential(min=0.2, max=4.0),
+        before_sleep=before_sleep_log(logger, logging.WARNING),
+        reraise=True,
+    )
+    async def _start_llm_stream(self, prompt: str) -> Tuple[AsyncIterator[Any], Optional[Any]]:
+        """Open the LLM stream and wait for its first non-empty chunk.
+
+        Returns the stream and that chunk (None if the model produced no text).
+        """
+        self.logger.info("Calling LLM")
+        # chat models always stream AIMessageChunk deltas
+        stream = self.llm.astream(prompt)
+        while True:
+            try:
+                response = await anext(stream)
+            except StopAsyncIteration:
+                return stream, None
+            if response.content:
+                return stream, response
+
+    async def query_stream(self, question: str, k: int = 6) -> AsyncIterator[Tuple[str, Any]]:
+        """Answer a question, yielding ("token", str) events as the LLM
+        generates and a final ("sources", List[dict]) event."""
+        if not question or not question.strip():
+            raise ValueError("Empty question provided")
+        k = max(1, min(k, MAX_K))
+
+        cache_key = self._query_cache_key(question, k)
+        cached = self._query_cache_get(cache_key)
+        if cached is not None:
+            self.logger.info("Query cache hit (hits=%s, misses=%s)", self.cache_hits, self.cache_misses)
+            answer, sources = cached
+            yield "token", answer
+            yield "sources", sources
+            return
 
-        # try multiple retriever method names for compatibility
-        docs = []
+        # embed the question once and search the quantized index directly
         try:
-            if hasattr(retriever, "get_relevant_documents"):
-                docs = retriever.get_relevant_documents(question)
-            elif hasattr(retriever, "retrieve"):
-                docs = retriever.retrieve(question)
-            elif hasattr(retriever, "invoke"):
-                docs = retriever.invoke(question)
-            else:
-                raise RAGError("Retriever has no supported retrieval method")
+            query_embedding = await self.embeddings_model.aembed_query(question)
+            docs = await asyncio.to_thread(self._search_by_vector, query_embedding, k)
         except Exception:
             self.logger.exception("Retrieval failed")
             raise RAGError("Retrieval failed")
 
-        self.logger.info(f"Retrieved {len(docs)} documents for the question")
+        self.logger.info("Retrieved %s documents for the question", len(docs))
 
         knowledge = self._build_knowledge(docs)
 
-        rag_prompt = f"""
-    You are an assistant which answers questions based only on the knowledge provided in the "The knowledge" section below.
-    Do not use external or internal world knowledge beyond the provided knowledge.
-    Keep the answer concise (max ~150 words). At the end, do NOT repeat the full source text — instead answer, then the system will provide exact source snippets separately.
+        rag_prompt = "".join([RAG_PROMPT_PREFIX, question, RAG_PROMPT_KNOWLEDGE_HEADER, knowledge, "\n    "])
 
-    Question: {question}
+        sources = [
+            {"source": d.metadata.get("source"),
+             "page": d.metadata.get("page"),
+             "snippet": (d.page_content or "")[:300]}
+            for d in docs
+        ]
 
-    The knowledge:
-    {knowledge}
-    """
+        # retries happen inside _start_llm_stream, i.e. only until the first
+        # token; once text has reached the client a failure is final
+        try:
+            stream, first = await self._start_llm_stream(rag_prompt)
+        except Exception as e:
+            self.logger.exception("LLM call failed after retries")
+            raise RAGError("LLM call failed") from e
 
-        # retry logic for LLM call
-        attempts = 0
-        max_attempts = 2
-        answer = ""
-        last_err: Optional[Exception] = None
-        while attempts < max_attempts:
-            try:
-                self.logger.info(f"Calling LLM (attempt {attempts + 1})")
-                for response in self.llm.stream(rag_prompt):
-                    # response may be a delta with .content
-                    answer += getattr(response, "content", str(response))
-
-                sources = [
-                    {"source": getattr(d, "metadata", {}).get("source"),
-                     "page": getattr(d, "metadata", {}).get("page"),
-                     "snippet": (d.page_content or "")[:300]}
-                    for d in docs
-                ]
-                self.logger.info("LLM call succeeded")
-                return answer, sources
-            except Exception as e:
-                last_err = e
-                attempts += 1
-                self.logger.warning(f"LLM call failed (attempt {attempts}): {e}")
-                time.sleep(1)
+        answer_parts: List[str] = []
+        try:
+            if first is not None:
+                answer_parts.append(first.content)
+                yield "token", first.content
+            async for response in stream:
+                delta = response.content
+                if delta:
+                    answer_parts.append(delta)
+                    yield "token", delta
+        except Exception as e:
+            self.logger.exception("LLM stream interrupted")
+            raise RAGError("LLM stream interrupted") from e
 
-        self.logger.exception("LLM call failed after retries")
-        raise RAGError("LLM call failed") from last_err
+        self.logger.info("LLM call succeeded")
+        self._query_cache_put(cache_key, "".join(answer_parts), sources)
+        yield "sources", sources
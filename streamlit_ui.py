@@ -1,11 +1,29 @@
+import json
 import streamlit as st
 import requests
-from typing import List
+from typing import Iterator, List, Tuple
 import os
 
 # Use environment variable or default to localhost for development
 API_URL = os.getenv("API_URL", "http://127.0.0.1:8000/chat")
 
+
+def iter_sse(resp) -> Iterator[Tuple[str, object]]:
+    # minimal server-sent events parser for the /chat stream
+    event, data_lines = "message", []
+    for line in resp.iter_lines(decode_unicode=True):
+        if line:
+            field, _, value = line.partition(":")
+            if field == "event":
+                event = value.strip()
+            elif field == "data":
+                data_lines.append(value.lstrip())
+            continue
+        if data_lines:
+            yield event, json.loads("\n".join(data_lines))
+        event, data_lines = "message", []
+
+
 st.title("RAG Chatbot Demo")
 
 st.markdown("Upload one or more PDFs and ask a question. The backend is the FastAPI RAG service.")
@@ -28,17 +46,26 @@ if st.button("Ask"):
                 multipart = [("question", (None, question))]
                 for f in uploaded_files:
                     multipart.append(("files", (f.name, f.getvalue(), "application/pdf")))
-                resp = requests.post(API_URL, files=multipart)
+                resp = requests.post(API_URL, files=multipart, stream=True)
             else:
-                resp = requests.post(API_URL, data={"question": question})
+                resp = requests.post(API_URL, data={"question": question}, stream=True)
 
             resp.raise_for_status()
         except Exception as e:
             st.error(f"Request failed: {e}")
         else:
-            data = resp.json()
             st.subheader("Answer")
-            st.write(data.get("answer"))
+            answer_box = st.empty()
+            answer = ""
+            sources = []
+            for event, data in iter_sse(resp):
+                if event == "token":
+                    answer += data
+                    answer_box.markdown(answer)
+                elif event == "sources":
+                    sources = data
+                elif event == "error":
+                    st.error(f"Request failed: {data.get('detail')}")
             st.subheader("Sources")
-            for s in data.get("sources", []):
+            for s in sources:
                 st.write(f"- {s.get('source')} (page {s.get('page')})")
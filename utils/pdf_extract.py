@@ -0,0 +1,32 @@
+from typing import List, Tuple
+
+# imported by the spawned PDF extraction workers: keep this module free of
+# heavy imports so a worker only ever loads PyMuPDF
+
+
+def open_pdf(path: str) -> "fitz.Document":
+    import fitz
+
+    # opening by path lets MuPDF read the file itself instead of us holding
+    # (and pickling to every worker) a second in-memory copy of it
+    doc = fitz.open(path, filetype="pdf")
+    # encrypted PDFs with an empty user password still open for reading
+    if doc.needs_pass and not doc.authenticate(""):
+        doc.close()
+        raise ValueError("PDF is password protected")
+    return doc
+
+
+def page_text(page) -> str:
+    try:
+        return page.get_text("text") or ""
+    except Exception:
+        return ""
+
+
+def extract_page_range(args: Tuple[str, int, int]) -> List[Tuple[int, str]]:
+    # runs in a worker process: fitz documents aren't picklable, so each
+    # worker re-opens the PDF from its path and extracts its page range
+    path, start, stop = args
+    with open_pdf(path) as doc:
+        return [(i, page_text(doc[i])) for i in range(start, stop)]
@@ -0,0 +1,49 @@
+from typing import Dict, List
+
+import tiktoken
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+
+class TokenLengthCache:
+    """Token counter for the splitter that memoizes results.
+
+    The recursive splitter asks for the length of the same pieces several times
+    (once when checking them against the chunk size, again while merging and
+    popping overlap), so each distinct string is only tokenized once.
+    """
+
+    def __init__(self, encoding_name: str = "cl100k_base"):
+        self._encoding = tiktoken.get_encoding(encoding_name)
+        self._lengths: Dict[str, int] = {}
+
+    def __call__(self, text: str) -> int:
+        length = self._lengths.get(text)
+        if length is None:
+            # special-token text in a PDF is counted as ordinary text
+            length = len(self._encoding.encode_ordinary(text))
+            self._lengths[text] = length
+        return length
+
+    def clear(self):
+        self._lengths.clear()
+
+
+class CachedTokenTextSplitter(RecursiveCharacterTextSplitter):
+    """RecursiveCharacterTextSplitter measuring chunk size in tiktoken tokens.
+
+    The per-split length lookups made by the base class are served from a
+    per-document cache. Splits are deliberately not tokenized with
+    ``encode_batch``: it starts a thread pool per call, which costs more than
+    encoding the few short splits of one recursion level.
+    """
+
+    def __init__(self, encoding_name: str = "cl100k_base", **kwargs):
+        self._token_lengths = TokenLengthCache(encoding_name)
+        super().__init__(length_function=self._token_lengths, **kwargs)
+
+    def split_text(self, text: str) -> List[str]:
+        try:
+            return super().split_text(text)
+        finally:
+            # lengths are only reused within one document; don't grow unbounded
+            self._token_lengths.clear()